@@ -12,12 +12,23 @@ The server will run on http://localhost:8001
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+import atexit
 import base64
+import hashlib
 import io
+import json
 import os
+import platform
+import random
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from PIL import Image
 
+from decode_pool import DecodePool, DecodePoolError, decode_rgb
+from image_stats import color_statistics, dominant_color_name
+
 # Configure a local cache directory for Hugging Face downloads to avoid permission issues
 BASE_DIR = Path(__file__).parent
 _CACHE_DIR = BASE_DIR / '.cache' / 'huggingface'
@@ -95,15 +106,132 @@ LABEL_CANDIDATES = sorted({
     'shopping cart', 'shopping bag', 'baby stroller', 'bicycle basket'
 })
 
+
+def _env_float(name, default):
+    """Read a float tunable from the environment, falling back to the default"""
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        print(f'⚠️  Ignoring invalid value for {name}: {os.environ.get(name)!r}')
+        return float(default)
+
+# Hardware profile written by autotune.py. Its values replace the built-in
+# defaults below; an environment variable still wins over the profile.
+PROFILE_PATH = Path(os.environ.get('PICDETECT_PROFILE', BASE_DIR / 'autotune_profile.json'))
+
+def _load_profile():
+    if not PROFILE_PATH.is_file():
+        return {}
+    try:
+        with open(PROFILE_PATH) as profile_file:
+            profile = json.load(profile_file)
+    except Exception as profile_error:
+        print(f'⚠️  Ignoring unreadable autotune profile {PROFILE_PATH}: {profile_error}')
+        return {}
+
+    # A profile tuned on other hardware (e.g. copied along with the repo) would
+    # apply the wrong thread and worker counts here
+    host = profile.get('host', {})
+    current = {
+        'cpu_count': os.cpu_count(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+    }
+    mismatches = [
+        f'{key} {host[key]!r} != {value!r}'
+        for key, value in current.items()
+        if key in host and host[key] != value
+    ]
+    if mismatches:
+        print(f'⚠️  Ignoring autotune profile {PROFILE_PATH}: tuned on different hardware '
+              f'({", ".join(mismatches)}); rerun python3 autotune.py')
+        return {}
+
+    print(f'✅ Loaded autotune profile: {PROFILE_PATH}')
+    return profile.get('config', {})
+
+_PROFILE = _load_profile()
+
+def _tunable(key, env_name, default):
+    """Resolve a tuned setting: environment, then autotune profile, then default"""
+    if env_name in os.environ:
+        return _env_float(env_name, default)
+    try:
+        return float(_PROFILE.get(key, default))
+    except (TypeError, ValueError):
+        return float(default)
+
+# Pre-inference triage: trivial images (blank, solid color, tiny, corrupt) are
+# answered without touching the models. An image only counts as blank or solid
+# when it is flat at the pixel level: every channel stays within a narrow range.
+# Every threshold can be tuned through the environment.
+TRIAGE_ENABLED = os.environ.get('PICDETECT_TRIAGE', '1') != '0'
+TRIAGE_THUMBNAIL_SIZE = int(_env_float('PICDETECT_TRIAGE_THUMBNAIL', 64))
+TRIAGE_MIN_SIDE = int(_env_float('PICDETECT_TRIAGE_MIN_SIDE', 16))
+TRIAGE_MAX_RANGE = _env_float('PICDETECT_TRIAGE_MAX_RANGE', 16)
+TRIAGE_MAX_VARIANCE = _env_float('PICDETECT_TRIAGE_MAX_VARIANCE', 20.0)
+TRIAGE_BLANK_RATIO = _env_float('PICDETECT_TRIAGE_BLANK_RATIO', 0.98)
+
+# Traffic capture: when PICDETECT_CAPTURE_DIR is set, a sample of /classify requests
+# is appended to <dir>/requests.jsonl, with each distinct image stored once under
+# <dir>/blobs/<sha256>. Use replay.py to re-issue the captured traffic.
+CAPTURE_DIR = os.environ.get('PICDETECT_CAPTURE_DIR')
+CAPTURE_SAMPLE_RATE = _env_float('PICDETECT_CAPTURE_SAMPLE_RATE', 0.1)
+_capture_lock = threading.Lock()
+
+# Decode stage: PIL decode, RGB conversion and downscaling run in a pool of worker
+# processes that hand pixels back through shared memory. Sized independently of
+# the inference threads; 0 decodes on the request thread instead.
+DECODE_WORKERS = int(_tunable('decode_workers', 'PICDETECT_DECODE_WORKERS', 2))
+DECODE_SLOTS = int(_env_float('PICDETECT_DECODE_SLOTS', DECODE_WORKERS * 4))
+DECODE_SIZE = int(_env_float('PICDETECT_DECODE_SIZE', 224))
+_decode_pool = None
+
+# Inference: torch thread pools (0 keeps torch's default) and micro-batching of
+# concurrent requests into one pipeline call (1 disables batching)
+TORCH_THREADS = int(_tunable('torch_threads', 'PICDETECT_TORCH_THREADS', 0))
+TORCH_INTEROP_THREADS = int(_tunable('torch_interop_threads', 'PICDETECT_TORCH_INTEROP_THREADS', 0))
+BATCH_SIZE = int(_tunable('batch_size', 'PICDETECT_BATCH_SIZE', 1))
+BATCH_TIMEOUT_MS = _env_float('PICDETECT_BATCH_TIMEOUT_MS', 10)
+
 # Lazily initialized Hugging Face pipelines (downloaded on first use)
 _clip_classifier = None
 _image_classifier = None
+_clip_batcher = None
+_image_batcher = None
+_torch_configured = False
+_models_lock = threading.Lock()
+
+# Counters for the triage stage and for model inference time, used to estimate
+# how much model time triage saved
+_stats_lock = threading.Lock()
+_triage_stats = {
+    'triaged': 0,
+    'by_reason': {},
+    'model_requests': 0,
+    'model_seconds': 0.0,
+}
+_inference_in_flight = 0
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
 @app.route('/classify', methods=['POST'])
 def classify_image():
+    started_at = time.time()
+    started = time.perf_counter()
+    response = app.make_response(_classify_request())
+    elapsed = time.perf_counter() - started
+    # Same measurement the capture records, so replays compare like with like
+    response.headers['Server-Timing'] = f'app;dur={elapsed * 1000:.3f}'
+    if CAPTURE_DIR and random.random() < CAPTURE_SAMPLE_RATE:
+        try:
+            capture_request(started_at, elapsed, response)
+        except Exception as capture_error:
+            print(f'⚠️  Failed to capture request: {capture_error}')
+    return response
+
+def _classify_request():
     try:
         data = request.get_json()
         
@@ -122,54 +250,58 @@ def classify_image():
             image_bytes = base64.b64decode(image_data)
         except Exception as e:
             return jsonify({'error': f'Invalid base64 image: {str(e)}'}), 400
-        
-        if not _TRANSFORMERS_AVAILABLE:
-            return jsonify({
-                'error': 'Missing dependency: transformers. Install with "pip install transformers torch pillow".'
-            }), 500
-
-        global _clip_classifier, _image_classifier
-        if _clip_classifier is None:
-            try:
-                _clip_classifier = pipeline(
-                    task='zero-shot-image-classification',
-                    model='openai/clip-vit-base-patch32'
-                )
-                print('✅ Loaded CLIP zero-shot image classifier: openai/clip-vit-base-patch32')
-            except Exception as model_error:  # pragma: no cover
-                print(f'⚠️  Failed to load CLIP classifier: {model_error}')
-                _clip_classifier = None
-        if _image_classifier is None:
-            try:
-                _image_classifier = pipeline(
-                    task='image-classification',
-                    model='google/vit-base-patch16-224'
-                )
-                print('✅ Loaded transformers image-classification pipeline: google/vit-base-patch16-224')
-            except Exception as model_error:  # pragma: no cover
-                print(f'⚠️  Failed to load ViT classifier: {model_error}')
-                _image_classifier = None
 
+        # Decode once, off the request thread when the decode pool is running;
+        # the triage statistics come back with the pixels
         try:
-            pil_image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+            pil_image, triage_stats = decode_image(image_bytes)
+        except DecodePoolError as pool_error:
+            print(f'⚠️  Image decoding failed: {pool_error}')
+            return jsonify({
+                'error': 'Image decoding is temporarily unavailable',
+                'details': str(pool_error)
+            }), 503
         except Exception as image_error:
+            if TRIAGE_ENABLED:
+                _record_triage('corrupt')
             return jsonify({
                 'error': 'Invalid image data',
                 'details': str(image_error)
             }), 400
+
+        if triage_stats is not None:
+            triaged = triage_result(triage_stats['width'], triage_stats['height'], triage_stats)
+            if triaged is not None:
+                reason, result = triaged
+                _record_triage(reason)
+                return jsonify(result)
+        
+        if not _TRANSFORMERS_AVAILABLE:
+            return jsonify({
+                'error': 'Missing dependency: transformers. Install with "pip install transformers torch pillow".'
+            }), 500
+
+        load_models()
+
+        inference_started = time.perf_counter()
         clip_predictions = []
         if _clip_classifier is not None:
             try:
-                clip_predictions = _clip_classifier(
-                    pil_image,
-                    candidate_labels=list(LABEL_CANDIDATES),
-                    hypothesis_template='a photo of {}'
-                )
+                with _track_inference():
+                    if _clip_batcher is not None:
+                        clip_predictions = _clip_batcher.submit(pil_image)
+                    else:
+                        clip_predictions = _clip_classifier(
+                            pil_image,
+                            candidate_labels=list(LABEL_CANDIDATES),
+                            hypothesis_template='a photo of {}'
+                        )
             except Exception as clip_error:
                 print(f'⚠️  CLIP classifier failed: {clip_error}')
                 clip_predictions = []
 
         if clip_predictions:
+            record_model_time(time.perf_counter() - inference_started)
             top_prediction = clip_predictions[0]
             label = top_prediction.get('label', 'Unknown')
             score = float(top_prediction.get('score', 0.0))
@@ -194,12 +326,17 @@ def classify_image():
 
         if _image_classifier is not None:
             try:
-                predictions = _image_classifier(pil_image, top_k=5)
+                with _track_inference():
+                    if _image_batcher is not None:
+                        predictions = _image_batcher.submit(pil_image)
+                    else:
+                        predictions = _image_classifier(pil_image, top_k=5)
             except Exception as inference_error:
                 print(f'⚠️  ViT classifier inference failed: {inference_error}')
                 predictions = []
 
             if predictions:
+                record_model_time(time.perf_counter() - inference_started)
                 top_prediction = predictions[0]
                 label = top_prediction.get('label', 'Unknown')
                 score = float(top_prediction.get('score', 0.0))
@@ -228,6 +365,233 @@ def classify_image():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """Report triage counters and the model time they saved"""
+    with _stats_lock:
+        triaged = _triage_stats['triaged']
+        by_reason = dict(_triage_stats['by_reason'])
+        # Corrupt uploads were rejected before inference even without triage
+        skipped_inference = triaged - by_reason.get('corrupt', 0)
+        model_requests = _triage_stats['model_requests']
+        model_seconds = _triage_stats['model_seconds']
+
+    avg_model_seconds = model_seconds / model_requests if model_requests else 0.0
+    return jsonify({
+        # Requests waiting on decode slots point at the decode stage; many
+        # concurrent inferences with idle decode slots point at the models
+        'decode': _decode_pool.stats() if _decode_pool is not None else {'workers': 0},
+        'inference': {
+            'in_flight': _inference_in_flight,
+            'requests': model_requests,
+            'avg_seconds': avg_model_seconds,
+            'torch_threads': TORCH_THREADS,
+            'torch_interop_threads': TORCH_INTEROP_THREADS,
+            'clip_batching': _clip_batcher.stats() if _clip_batcher is not None else None,
+            'vit_batching': _image_batcher.stats() if _image_batcher is not None else None,
+        },
+        'triage': {
+            'enabled': TRIAGE_ENABLED,
+            'triaged': triaged,
+            'by_reason': by_reason,
+            'model_requests': model_requests,
+            'avg_model_seconds': avg_model_seconds,
+            # Every request triage answered would otherwise have paid the average model latency
+            'model_seconds_saved': skipped_inference * avg_model_seconds,
+        }
+    })
+
+def capture_request(started_at, elapsed, response):
+    """Append a compact record of the current /classify request to the capture log"""
+    data = request.get_json(silent=True) or {}
+    image_data = data.get('image') or data.get('image_base64') or ''
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    try:
+        image_bytes = base64.b64decode(image_data)
+    except Exception:
+        # Undecodable payloads cannot be replayed
+        return
+    if not image_bytes:
+        return
+
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    result = response.get_json(silent=True) or {}
+    record = {
+        'ts': started_at,
+        'image': digest,
+        'size': len(image_bytes),
+        'status': response.status_code,
+        # Server-side handler time, also sent to clients as the Server-Timing header
+        'latency_ms': elapsed * 1000,
+        'source': result.get('source'),
+        'name': result.get('name'),
+        'category': result.get('category'),
+        'confidence': result.get('confidence'),
+    }
+
+    capture_dir = Path(CAPTURE_DIR)
+    blob_path = capture_dir / 'blobs' / digest
+    with _capture_lock:
+        if not blob_path.exists():
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            blob_path.write_bytes(image_bytes)
+        with open(capture_dir / 'requests.jsonl', 'a') as log:
+            log.write(json.dumps(record) + '\n')
+
+def configure_torch():
+    """Apply the configured torch thread counts; must run before the first inference"""
+    global _torch_configured
+    if _torch_configured:
+        return
+    if TORCH_THREADS <= 0 and TORCH_INTEROP_THREADS <= 0:
+        # Nothing to set; leave the import to the pipelines
+        _torch_configured = True
+        return
+    import torch
+    if TORCH_THREADS > 0:
+        torch.set_num_threads(TORCH_THREADS)
+    if TORCH_INTEROP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+        except RuntimeError as thread_error:
+            # torch only accepts this before any inter-op work has started
+            print(f'⚠️  Could not set torch inter-op threads: {thread_error}')
+    _torch_configured = True
+
+def load_models():
+    """Load the Hugging Face pipelines (and their batchers) if not loaded yet"""
+    global _clip_classifier, _image_classifier, _clip_batcher, _image_batcher
+    with _models_lock:
+        configure_torch()
+        if _clip_classifier is None:
+            try:
+                _clip_classifier = pipeline(
+                    task='zero-shot-image-classification',
+                    model='openai/clip-vit-base-patch32'
+                )
+                print('✅ Loaded CLIP zero-shot image classifier: openai/clip-vit-base-patch32')
+            except Exception as model_error:  # pragma: no cover
+                print(f'⚠️  Failed to load CLIP classifier: {model_error}')
+                _clip_classifier = None
+        if _image_classifier is None:
+            try:
+                _image_classifier = pipeline(
+                    task='image-classification',
+                    model='google/vit-base-patch16-224'
+                )
+                print('✅ Loaded transformers image-classification pipeline: google/vit-base-patch16-224')
+            except Exception as model_error:  # pragma: no cover
+                print(f'⚠️  Failed to load ViT classifier: {model_error}')
+                _image_classifier = None
+
+        if BATCH_SIZE > 1:
+            from batcher import MicroBatcher
+            if _clip_classifier is not None and _clip_batcher is None:
+                _clip_batcher = MicroBatcher(
+                    lambda images: _clip_classifier(
+                        images,
+                        candidate_labels=list(LABEL_CANDIDATES),
+                        hypothesis_template='a photo of {}',
+                        batch_size=len(images)
+                    ),
+                    BATCH_SIZE,
+                    BATCH_TIMEOUT_MS / 1000
+                )
+            if _image_classifier is not None and _image_batcher is None:
+                _image_batcher = MicroBatcher(
+                    lambda images: _image_classifier(images, top_k=5, batch_size=len(images)),
+                    BATCH_SIZE,
+                    BATCH_TIMEOUT_MS / 1000
+                )
+
+def start_decode_pool():
+    """Start the decode worker processes; call before the server starts serving"""
+    global _decode_pool
+    if DECODE_WORKERS <= 0 or _decode_pool is not None:
+        return
+    try:
+        _decode_pool = DecodePool(
+            DECODE_WORKERS, max(1, DECODE_SLOTS), short_side=DECODE_SIZE, max_side=DECODE_SIZE * 4
+        )
+        atexit.register(_decode_pool.close)
+        print(f'✅ Started {DECODE_WORKERS} decode workers with {max(1, DECODE_SLOTS)} shared-memory slots')
+    except Exception as pool_error:  # pragma: no cover
+        print(f'⚠️  Failed to start decode workers, decoding on request threads: {pool_error}')
+        _decode_pool = None
+
+def decode_image(image_bytes):
+    """Decode an upload to an RGB PIL image, in the decode pool when it is running.
+
+    Returns the image and its triage statistics (None when triage is disabled).
+    """
+    triage_size = TRIAGE_THUMBNAIL_SIZE if TRIAGE_ENABLED else 0
+    if _decode_pool is not None:
+        return _decode_pool.decode(image_bytes, triage_size)
+    return decode_rgb(image_bytes, DECODE_SIZE, DECODE_SIZE * 4, triage_size)
+
+@contextmanager
+def _track_inference():
+    global _inference_in_flight
+    with _stats_lock:
+        _inference_in_flight += 1
+    try:
+        yield
+    finally:
+        with _stats_lock:
+            _inference_in_flight -= 1
+
+def record_model_time(seconds):
+    """Record the inference time of a request answered by a model"""
+    with _stats_lock:
+        _triage_stats['model_requests'] += 1
+        _triage_stats['model_seconds'] += seconds
+
+def _record_triage(reason):
+    with _stats_lock:
+        _triage_stats['triaged'] += 1
+        _triage_stats['by_reason'][reason] = _triage_stats['by_reason'].get(reason, 0) + 1
+
+def triage_result(width, height, stats):
+    """Decide from triage_statistics whether an image can skip the models.
+
+    Only images that are flat at the pixel level are answered here; anything
+    with a visible edge, however small, goes to the models. Returns a
+    (reason, result) pair, or None for full inference.
+    """
+    if width < TRIAGE_MIN_SIDE or height < TRIAGE_MIN_SIDE:
+        reason = 'tiny'
+        result = {
+            'name': 'Tiny Image',
+            'category': 'Unknown',
+            'confidence': 0.50,
+            'description': f'The image is only {width}x{height} pixels, which is too small to identify its contents.'
+        }
+    elif stats['max_range'] > TRIAGE_MAX_RANGE or stats['color_variance'] > TRIAGE_MAX_VARIANCE:
+        return None
+    elif stats['white_ratio'] >= TRIAGE_BLANK_RATIO or stats['black_ratio'] >= TRIAGE_BLANK_RATIO:
+        reason = 'blank'
+        color_name = 'White' if stats['white_ratio'] >= stats['black_ratio'] else 'Black'
+        result = {
+            'name': f'Blank {color_name} Image',
+            'category': 'Unknown',
+            'confidence': 0.95,
+            'description': f'A blank {color_name.lower()} image with no visible content to identify.'
+        }
+    else:
+        reason = 'uniform'
+        color_name = dominant_color_name(stats)
+        result = {
+            'name': f'Solid {color_name} Image',
+            'category': 'Unknown',
+            'confidence': 0.90,
+            'description': f'A uniform {color_name.lower()} image with no distinct objects to identify.'
+        }
+
+    result['source'] = 'triage'
+    result['triage_reason'] = reason
+    return reason, result
+
 def format_label(label):
     """Convert labels like 'tabby, tabby cat' to readable format"""
     return label.replace('_', ' ').split(',')[0].title()
@@ -367,20 +731,14 @@ def use_fallback_classification(image_bytes, reason='unknown'):
             img.thumbnail((500, 500), Image.Resampling.LANCZOS)
             width, height = img.size
         
-        # Get pixel data
-        pixels = list(img.getdata())
+        # Get pixel data as (r, g, b) tuples
+        pixels = list(zip(*(band.tobytes() for band in img.split())))
         total_pixels = len(pixels)
         
-        # Calculate average color
-        avg_r = sum(p[0] for p in pixels) / total_pixels
-        avg_g = sum(p[1] for p in pixels) / total_pixels
-        avg_b = sum(p[2] for p in pixels) / total_pixels
-        
-        # Calculate color variance (helps detect if image has distinct objects)
-        var_r = sum((p[0] - avg_r) ** 2 for p in pixels) / total_pixels
-        var_g = sum((p[1] - avg_g) ** 2 for p in pixels) / total_pixels
-        var_b = sum((p[2] - avg_b) ** 2 for p in pixels) / total_pixels
-        color_variance = (var_r + var_g + var_b) / 3
+        # Average color, color variance and white/black share (shared with triage)
+        stats = color_statistics(img)
+        avg_r, avg_g, avg_b = stats['avg_r'], stats['avg_g'], stats['avg_b']
+        color_variance = stats['color_variance']
         
         # Count orange/ginger/brown pixels (common cat colors)
         orange_pixels = sum(1 for p in pixels if 
@@ -403,7 +761,7 @@ def use_fallback_classification(image_bytes, reason='unknown'):
         confidence = 0.60
         
         # Calculate brightness (helps distinguish animals)
-        brightness = (avg_r + avg_g + avg_b) / 3
+        brightness = stats['brightness']
         
         # Check for golden/yellow tones (common in golden retrievers)
         golden_pixels = sum(1 for p in pixels if 
@@ -467,11 +825,8 @@ def use_fallback_classification(image_bytes, reason='unknown'):
         red_pixels = sum(1 for p in pixels if p[0] > 150 and p[0] > p[1] * 1.3 and p[0] > p[2] * 1.3)
         red_ratio = red_pixels / total_pixels if total_pixels > 0 else 0
         
-        white_pixels = sum(1 for p in pixels if p[0] > 200 and p[1] > 200 and p[2] > 200)
-        white_ratio = white_pixels / total_pixels if total_pixels > 0 else 0
-        
-        black_pixels = sum(1 for p in pixels if (p[0] + p[1] + p[2]) / 3 < 50)
-        black_ratio = black_pixels / total_pixels if total_pixels > 0 else 0
+        white_ratio = stats['white_ratio']
+        black_ratio = stats['black_ratio']
         
         # IMPORTANT: Check for animals FIRST, even with green backgrounds
         # Animals often appear on grass/outdoor scenes with green backgrounds
@@ -645,18 +1000,7 @@ def use_fallback_classification(image_bytes, reason='unknown'):
         # Low complexity - simple object or background
         else:
             # Determine dominant color
-            if avg_r > avg_g and avg_r > avg_b:
-                color_name = 'Red'
-            elif avg_g > avg_r and avg_g > avg_b:
-                color_name = 'Green'
-            elif avg_b > avg_r and avg_b > avg_g:
-                color_name = 'Blue'
-            elif brightness > 200:
-                color_name = 'Light'
-            elif brightness < 50:
-                color_name = 'Dark'
-            else:
-                color_name = 'Colored'
+            color_name = dominant_color_name(stats)
             
             result = {
                 'name': f'{color_name} Object',
@@ -684,6 +1028,11 @@ if __name__ == '__main__':
     print('🚀 PicDetect API Proxy Server')
     print('📡 Running on http://localhost:8001')
     print('🔗 This server proxies requests to Hugging Face API')
+    if CAPTURE_DIR:
+        print(f'🎥 Capturing {CAPTURE_SAMPLE_RATE:.0%} of requests to {CAPTURE_DIR}')
+    print(f'⚙️  torch threads: {TORCH_THREADS or "default"}, inter-op: {TORCH_INTEROP_THREADS or "default"}, '
+          f'batch size: {BATCH_SIZE}, decode workers: {DECODE_WORKERS}, decode size: {DECODE_SIZE}')
     print('⏹️  Press Ctrl+C to stop\n')
+    start_decode_pool()
     app.run(host='0.0.0.0', port=8001, debug=False)
 
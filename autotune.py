@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Hardware-aware autotuner for the PicDetect API proxy
+
+Sweeps torch intra-op and inter-op thread counts, inference batch size and
+decode worker processes on this host, using the real models and a synthetic
+image corpus. Picks the configuration with the highest
+throughput whose p99 latency stays under the target and writes it to the
+profile file that api_proxy.py loads at startup.
+
+Usage:
+    python3 autotune.py
+    python3 autotune.py --target-p99-ms 1500 --duration 30 --concurrency 16
+
+Each trial runs in a fresh process because torch only accepts thread settings
+before its first inference. The sweep is staged: each parameter is tuned in
+turn with the best values found so far for the others.
+
+The decode size (PICDETECT_DECODE_SIZE) is not tuned: both pipelines resize
+to 224px whatever they are given, so it only controls pre-scaling.
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from replay import percentile
+
+BASE_DIR = Path(__file__).parent
+DEFAULT_PROFILE = Path(os.environ.get('PICDETECT_PROFILE', BASE_DIR / 'autotune_profile.json'))
+
+# Environment variable read by api_proxy.py for each tuned setting
+SETTINGS = {
+    'torch_threads': 'PICDETECT_TORCH_THREADS',
+    'torch_interop_threads': 'PICDETECT_TORCH_INTEROP_THREADS',
+    'batch_size': 'PICDETECT_BATCH_SIZE',
+    'decode_workers': 'PICDETECT_DECODE_WORKERS',
+}
+
+CORPUS_SIZES = [(640, 480), (1024, 768), (1920, 1080), (800, 800), (1080, 1920)]
+
+
+def thread_options(cpu_count):
+    return sorted({n for n in (1, 2, 4, cpu_count // 2, cpu_count) if 1 <= n <= cpu_count})
+
+
+def build_corpus(count, seed=0):
+    """Deterministic JPEG images with enough structure to pass triage"""
+    rng = random.Random(seed)
+    corpus = []
+    for index in range(count):
+        width, height = CORPUS_SIZES[index % len(CORPUS_SIZES)]
+        top = tuple(rng.randrange(256) for _ in range(3))
+        bottom = tuple(rng.randrange(256) for _ in range(3))
+        img = Image.linear_gradient('L').resize((width, height))
+        img = Image.composite(Image.new('RGB', img.size, bottom), Image.new('RGB', img.size, top), img)
+
+        draw = ImageDraw.Draw(img)
+        for _ in range(rng.randint(3, 12)):
+            x0, y0 = rng.randrange(width), rng.randrange(height)
+            x1 = min(width, x0 + rng.randint(width // 20, width // 2))
+            y1 = min(height, y0 + rng.randint(height // 20, height // 2))
+            fill = tuple(rng.randrange(256) for _ in range(3))
+            if rng.random() < 0.5:
+                draw.ellipse((x0, y0, x1, y1), fill=fill)
+            else:
+                draw.rectangle((x0, y0, x1, y1), fill=fill)
+        img = img.filter(ImageFilter.GaussianBlur(1))
+
+        buffer = BytesIO()
+        img.save(buffer, 'JPEG', quality=85)
+        corpus.append(base64.b64encode(buffer.getvalue()).decode())
+    return corpus
+
+
+def run_trial(args):
+    """Measure the configuration given by the environment; runs in a child process"""
+    import api_proxy
+
+    if not api_proxy._TRANSFORMERS_AVAILABLE:
+        raise SystemExit('transformers is not installed; autotune needs the real models')
+    api_proxy.start_decode_pool()
+    api_proxy.load_models()
+    if api_proxy._clip_classifier is None and api_proxy._image_classifier is None:
+        raise SystemExit('No model pipeline could be loaded')
+
+    corpus = build_corpus(args.corpus_size)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(worker_index, stop_at):
+        test_client = api_proxy.app.test_client()
+        index = worker_index
+        while time.perf_counter() < stop_at:
+            payload = {'image': corpus[index % len(corpus)]}
+            index += args.concurrency
+            started = time.perf_counter()
+            response = test_client.post('/classify', json=payload)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            source = (response.get_json(silent=True) or {}).get('source')
+            with lock:
+                if response.status_code == 200 and source in ('clip-zero-shot', 'transformers-vit'):
+                    latencies.append(elapsed_ms)
+                else:
+                    errors.append(source or response.status_code)
+
+    def run_clients(duration):
+        stop_at = time.perf_counter() + duration
+        threads = [
+            threading.Thread(target=client, args=(i, stop_at)) for i in range(args.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # Warm up caches and allocator before measuring
+    run_clients(min(5.0, args.duration / 4))
+    latencies.clear()
+    errors.clear()
+
+    measure_started = time.perf_counter()
+    run_clients(args.duration)
+    elapsed = time.perf_counter() - measure_started
+
+    print(json.dumps({
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput_rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50),
+        'p99_ms': percentile(latencies, 99),
+    }))
+
+
+def measure(config, args, cache):
+    """Run one trial subprocess for config, reusing earlier results"""
+    key = tuple(sorted(config.items()))
+    if key in cache:
+        return cache[key]
+
+    env = dict(os.environ)
+    for name, env_name in SETTINGS.items():
+        env[env_name] = str(config[name])
+    # Trials must not pick up an old profile or record traffic
+    env['PICDETECT_PROFILE'] = os.devnull
+    env.pop('PICDETECT_CAPTURE_DIR', None)
+
+    command = [
+        sys.executable, str(Path(__file__).resolve()), '--trial',
+        '--duration', str(args.duration),
+        '--concurrency', str(args.concurrency),
+        '--corpus-size', str(args.corpus_size),
+    ]
+    description = ', '.join(f'{name}={value}' for name, value in config.items())
+    print(f'🧪 {description}')
+    try:
+        completed = subprocess.run(
+            command, env=env, cwd=BASE_DIR, capture_output=True, text=True,
+            timeout=args.duration * 2 + 900
+        )
+        if completed.returncode != 0:
+            raise RuntimeError((completed.stderr.strip().splitlines() or ['exited with an error'])[-1])
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+    except Exception as trial_error:
+        print(f'   ⚠️  Trial failed: {trial_error}')
+        result = None
+
+    if result is not None:
+        print(f'   {result["throughput_rps"]:.2f} req/s, p50 {result["p50_ms"]:.0f} ms, '
+              f'p99 {result["p99_ms"]:.0f} ms, {result["errors"]} errors')
+    cache[key] = result
+    return result
+
+
+def better(candidate, incumbent, target_p99_ms):
+    """Prefer configurations meeting the p99 target, then higher throughput"""
+    if candidate is None or candidate['requests'] == 0 or candidate['errors']:
+        return False
+    if incumbent is None:
+        return True
+    candidate_ok = candidate['p99_ms'] <= target_p99_ms
+    incumbent_ok = incumbent['p99_ms'] <= target_p99_ms
+    if candidate_ok != incumbent_ok:
+        return candidate_ok
+    if candidate_ok:
+        return candidate['throughput_rps'] > incumbent['throughput_rps']
+    return candidate['p99_ms'] < incumbent['p99_ms']
+
+
+def autotune(args):
+    cpu_count = os.cpu_count() or 1
+    threads = thread_options(cpu_count)
+    stages = [
+        ('torch_threads', threads),
+        ('torch_interop_threads', [n for n in (1, 2, 4) if n <= cpu_count]),
+        ('batch_size', args.batch_sizes),
+        ('decode_workers', [n for n in args.decode_workers if n <= cpu_count]),
+    ]
+
+    best_config = {
+        'torch_threads': threads[-1],
+        'torch_interop_threads': 1,
+        'batch_size': 1,
+        'decode_workers': min(2, cpu_count),
+    }
+    cache = {}
+    best_result = measure(best_config, args, cache)
+    # The starting point must pass the same checks as every other candidate
+    if not better(best_result, None, args.target_p99_ms):
+        best_result = None
+
+    for name, options in stages:
+        print(f'\n🔧 Tuning {name}: {options}')
+        for value in options:
+            config = dict(best_config, **{name: value})
+            result = measure(config, args, cache)
+            if better(result, best_result, args.target_p99_ms):
+                best_config, best_result = config, result
+
+    if best_result is None:
+        raise SystemExit('❌ No trial completed without errors; see the output above')
+
+    profile = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'host': {
+            'platform': platform.platform(),
+            'system': platform.system(),
+            'machine': platform.machine(),
+            'processor': platform.processor() or platform.machine(),
+            'cpu_count': cpu_count,
+            'python': platform.python_version(),
+        },
+        'target_p99_ms': args.target_p99_ms,
+        'concurrency': args.concurrency,
+        'config': best_config,
+        'measured': best_result,
+        'trials': [
+            dict(dict(key), result=result) for key, result in cache.items()
+        ],
+    }
+    args.output.write_text(json.dumps(profile, indent=2) + '\n')
+
+    met = best_result['p99_ms'] <= args.target_p99_ms
+    print(f'\n✅ Best configuration: {best_config}')
+    print(f'   {best_result["throughput_rps"]:.2f} req/s, p99 {best_result["p99_ms"]:.0f} ms '
+          f'({"meets" if met else "misses"} the {args.target_p99_ms:.0f} ms target)')
+    print(f'📝 Wrote {args.output}; restart api_proxy.py to use it')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune PicDetect inference settings for this host')
+    parser.add_argument('--target-p99-ms', type=float, default=2000.0,
+                        help='p99 latency the chosen configuration must stay under')
+    parser.add_argument('--duration', type=float, default=20.0, help='measured seconds per trial')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients during a trial')
+    parser.add_argument('--corpus-size', type=int, default=32, help='number of synthetic images')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--decode-workers', type=int, nargs='+', default=[0, 1, 2, 4])
+    parser.add_argument('--output', type=Path, default=DEFAULT_PROFILE,
+                        help=f'profile file to write (default {DEFAULT_PROFILE})')
+    parser.add_argument('--trial', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trial:
+        run_trial(args)
+    else:
+        autotune(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Micro-batching for the PicDetect API proxy
+
+Request threads submit single images; a background thread groups whatever
+arrives within a short window into one batched pipeline call and hands each
+request its own result.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Collect concurrent single-item calls into batches for run_batch"""
+
+    def __init__(self, run_batch, max_batch_size, max_wait_seconds):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Run item as part of the next batch and return its result"""
+        future = Future()
+        self._queue.put((item, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Wait briefly for more work, but never past a full batch
+            deadline = time.monotonic() + self.max_wait_seconds
+            try:
+                while len(batch) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                pass
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.run_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f'Batch of {len(items)} returned {len(results)} results')
+            except Exception as batch_error:
+                for _, future in batch:
+                    future.set_exception(batch_error)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+            with self._lock:
+                self._batches += 1
+                self._items += len(batch)
+
+    def stats(self):
+        with self._lock:
+            batches, items = self._batches, self._items
+        return {
+            'max_batch_size': self.max_batch_size,
+            'batches': batches,
+            'queue_depth': self._queue.qsize(),
+            'avg_batch_size': items / batches if batches else 0.0,
+        }
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Out-of-process image decoding for the PicDetect API proxy
+
+Uploaded bytes are decoded, converted to RGB and downscaled to model input
+resolution by a pool of worker processes, which also compute the triage
+statistics so each upload is decoded exactly once. Workers write the
+resulting uint8 pixels into a ring of fixed-size slots in one shared-memory
+block, so only the size and statistics cross the process boundary. This is
+not zero-copy: the request thread copies the slot into a new PIL image
+(Image.frombuffer copies for RGB, which is not a mode PIL can map directly),
+so the slot can go back to the ring at once. That copy is a single memcpy
+of a model-sized image and holds the GIL for far less time than decoding.
+
+Workers are forked from a forkserver that has preloaded only this module
+(and PIL), never from the live server: by the time a worker has to be
+replaced the server runs request, batcher and torch threads, and forking a
+multi-threaded process can deadlock the child.
+"""
+
+import io
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+from image_stats import triage_statistics
+
+# Shared-memory block attached by each worker process
+_worker_shm = None
+
+
+class DecodePoolError(RuntimeError):
+    """The decode pool itself failed, as opposed to the uploaded image"""
+
+
+def _init_worker(shm_name):
+    global _worker_shm
+    # Ctrl+C is handled by the server, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+
+
+def _warm_up():
+    return True
+
+
+def decode_rgb(image_bytes, short_side, max_side, triage_size=0):
+    """Decode image bytes to RGB, downscaled toward model input resolution.
+
+    Returns the image and, when triage_size is set, its triage statistics
+    along with the original width and height.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    original_width, original_height = img.size
+    # Let JPEG decode at a reduced scale that still covers the target size
+    img.draft('RGB', (short_side, short_side))
+    img = img.convert('RGB')
+
+    stats = None
+    if triage_size:
+        stats = triage_statistics(img, triage_size)
+        stats['width'] = original_width
+        stats['height'] = original_height
+
+    # Shortest edge to model input size, never upscaling, long edge capped
+    width, height = img.size
+    scale = min(1.0, short_side / min(width, height), max_side / max(width, height))
+    if scale < 1.0:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        img = img.resize(size, Image.Resampling.BICUBIC)
+    return img, stats
+
+
+def _decode_into_slot(image_bytes, offset, capacity, short_side, max_side, triage_size):
+    """Decode one image into the shared-memory slot at offset; return its size and statistics"""
+    img, stats = decode_rgb(image_bytes, short_side, max_side, triage_size)
+    data = img.tobytes()
+    if len(data) > capacity:
+        raise ValueError(f'Decoded image of {len(data)} bytes does not fit a {capacity}-byte slot')
+    _worker_shm.buf[offset:offset + len(data)] = data
+    return img.size, stats
+
+
+class DecodePool:
+    """Process pool that decodes uploads into a shared-memory ring buffer"""
+
+    def __init__(self, workers, slots, short_side=224, max_side=896):
+        self.workers = workers
+        self.slots = slots
+        self.short_side = short_side
+        self.max_side = max_side
+        self.slot_bytes = short_side * max_side * 3
+
+        self._shm = shared_memory.SharedMemory(create=True, size=slots * self.slot_bytes)
+        self._free_slots = queue.Queue()
+        for slot in range(slots):
+            self._free_slots.put(slot)
+
+        self._lock = threading.Lock()
+        self._restart_lock = threading.Lock()
+        self._stats = {
+            'waiting_for_slot': 0,
+            'in_flight': 0,
+            'decoded': 0,
+            'failed': 0,
+            'slot_wait_seconds': 0.0,
+            'decode_seconds': 0.0,
+            'restarts': 0,
+        }
+
+        # The forkserver starts with the pool, before the server's threads, and
+        # is reused by restarts; workers do not re-import the server module
+        # and its model stack the way spawned processes would
+        self._mp_context = multiprocessing.get_context('forkserver')
+        self._mp_context.set_forkserver_preload(['decode_pool'])
+        self._executor = self._start_executor()
+
+    def _start_executor(self):
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=self._mp_context,
+            initializer=_init_worker,
+            initargs=(self._shm.name,)
+        )
+        # Launch every worker now rather than on demand from a request thread
+        executor.submit(_warm_up).result()
+        return executor
+
+    def _restart(self, broken_executor):
+        """Replace an executor whose worker died; concurrent callers restart it once"""
+        with self._restart_lock:
+            if self._executor is not broken_executor:
+                return
+            with self._lock:
+                self._stats['restarts'] += 1
+            broken_executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._start_executor()
+
+    def decode(self, image_bytes, triage_size=0):
+        """Decode image bytes to an RGB PIL image using a worker process.
+
+        Returns the image and its triage statistics (None unless triage_size
+        is set). Raises DecodePoolError when a worker died instead of failing
+        on the image; the pool is restarted for the next request.
+        """
+        with self._lock:
+            self._stats['waiting_for_slot'] += 1
+        wait_started = time.perf_counter()
+        slot = self._free_slots.get()
+        decode_started = time.perf_counter()
+        with self._lock:
+            self._stats['waiting_for_slot'] -= 1
+            self._stats['in_flight'] += 1
+            self._stats['slot_wait_seconds'] += decode_started - wait_started
+
+        offset = slot * self.slot_bytes
+        executor = self._executor
+        try:
+            try:
+                size, stats = executor.submit(
+                    _decode_into_slot, image_bytes, offset, self.slot_bytes,
+                    self.short_side, self.max_side, triage_size
+                ).result()
+            except BrokenProcessPool as pool_error:
+                # Not retried inline: the upload itself may be what killed the worker
+                print(f'⚠️  Decode worker died ({pool_error}); restarting decode pool')
+                try:
+                    self._restart(executor)
+                except Exception as restart_error:
+                    # The next request tries again
+                    print(f'⚠️  Failed to restart decode pool: {restart_error}')
+                raise DecodePoolError('Decode worker process died') from pool_error
+            length = size[0] * size[1] * 3
+            with self._shm.buf[offset:offset + length] as pixels:
+                # Copies the pixels out of the slot before it goes back to the ring
+                image = Image.frombuffer('RGB', size, pixels, 'raw', 'RGB', 0, 1)
+                image.load()
+        except Exception:
+            with self._lock:
+                self._stats['failed'] += 1
+            raise
+        finally:
+            self._free_slots.put(slot)
+            with self._lock:
+                self._stats['in_flight'] -= 1
+
+        with self._lock:
+            self._stats['decoded'] += 1
+            self._stats['decode_seconds'] += time.perf_counter() - decode_started
+        return image, stats
+
+    def stats(self):
+        """Queue-depth and timing counters for the decode stage"""
+        with self._lock:
+            stats = dict(self._stats)
+        completed = stats['decoded'] + stats['failed']
+        return {
+            'workers': self.workers,
+            'slots': self.slots,
+            'slots_in_use': stats['in_flight'],
+            'waiting_for_slot': stats['waiting_for_slot'],
+            # Jobs submitted beyond the number of workers wait in the pool's queue
+            'queue_depth': max(0, stats['in_flight'] - self.workers),
+            'decoded': stats['decoded'],
+            'failed': stats['failed'],
+            'restarts': stats['restarts'],
+            'avg_slot_wait_seconds': stats['slot_wait_seconds'] / completed if completed else 0.0,
+            'avg_decode_seconds': stats['decode_seconds'] / stats['decoded'] if stats['decoded'] else 0.0,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._shm.close()
+        self._shm.unlink()
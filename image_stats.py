@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Color statistics shared by the PicDetect triage stage and heuristic fallback
+
+Only PIL is imported here so decode worker processes can use it too.
+"""
+
+from PIL import Image, ImageChops, ImageStat
+
+
+def color_statistics(img):
+    """Average color, color variance and white/black pixel share of an RGB image"""
+    stat = ImageStat.Stat(img)
+    avg_r, avg_g, avg_b = stat.mean[:3]
+
+    # Count in C via histograms instead of looping over pixels in Python.
+    # White: every channel above 200, i.e. the darkest channel is.
+    # Black: mean below 50, i.e. channel sum below 150; add() clips at 255,
+    # which never moves a sum across that threshold.
+    red, green, blue = img.split()[:3]
+    total_pixels = img.width * img.height or 1
+    darkest = ImageChops.darker(ImageChops.darker(red, green), blue)
+    white_pixels = sum(darkest.histogram()[201:])
+    channel_sum = ImageChops.add(ImageChops.add(red, green), blue)
+    black_pixels = sum(channel_sum.histogram()[:150])
+
+    return {
+        'avg_r': avg_r,
+        'avg_g': avg_g,
+        'avg_b': avg_b,
+        'brightness': (avg_r + avg_g + avg_b) / 3,
+        # Helps detect if image has distinct objects
+        'color_variance': sum(stat.var[:3]) / 3,
+        'white_ratio': white_pixels / total_pixels,
+        'black_ratio': black_pixels / total_pixels,
+    }
+
+
+def dominant_color_name(stats):
+    """Name the dominant color described by color_statistics"""
+    avg_r, avg_g, avg_b = stats['avg_r'], stats['avg_g'], stats['avg_b']
+    if avg_r > avg_g and avg_r > avg_b:
+        return 'Red'
+    if avg_g > avg_r and avg_g > avg_b:
+        return 'Green'
+    if avg_b > avg_r and avg_b > avg_g:
+        return 'Blue'
+    if stats['brightness'] > 200:
+        return 'Light'
+    if stats['brightness'] < 50:
+        return 'Dark'
+    return 'Colored'
+
+
+def triage_statistics(img, thumbnail_size):
+    """Statistics used to decide whether an image is flat enough to skip the models.
+
+    The per-channel value range is taken from img itself, so a thin line or a
+    small object still counts even when a thumbnail would average it away; the
+    color statistics come from a thumbnail to keep the per-pixel loops short.
+    """
+    max_range = max(high - low for low, high in img.getextrema()[:3])
+
+    thumbnail = img.copy()
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size), Image.Resampling.BOX)
+    stats = color_statistics(thumbnail)
+    stats['max_range'] = max_range
+    return stats
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Replay captured PicDetect traffic against a /classify endpoint
+
+Reads a capture directory written by api_proxy.py (PICDETECT_CAPTURE_DIR),
+re-issues every request at its original pacing (or N times faster) and
+reports the latency distribution and any results that changed.
+
+Usage:
+    python3 replay.py .capture
+    python3 replay.py .capture --speed 4 --url http://localhost:8001/classify
+    python3 replay.py .capture --speed 0     # as fast as possible
+"""
+
+import argparse
+import base64
+import json
+import math
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+DEFAULT_URL = 'http://localhost:8001/classify'
+
+# Response fields compared between the capture and the replay
+COMPARED_FIELDS = ('status', 'source', 'name', 'category')
+
+
+def load_capture(capture_dir):
+    """Load captured request records, ordered by their original start time"""
+    records = []
+    with open(capture_dir / 'requests.jsonl') as log:
+        for line_number, line in enumerate(log, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                print(f'⚠️  Skipping malformed line {line_number}')
+    records.sort(key=lambda r: r['ts'])
+    return records
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct * len(ordered) / 100) - 1))
+    return ordered[index]
+
+
+def server_time_ms(header):
+    """Handler time from a Server-Timing header such as 'app;dur=12.3', or None"""
+    for metric in (header or '').split(','):
+        name, *params = [part.strip() for part in metric.split(';')]
+        if name != 'app':
+            continue
+        for param in params:
+            key, _, value = param.partition('=')
+            if key == 'dur':
+                try:
+                    return float(value)
+                except ValueError:
+                    return None
+    return None
+
+
+def send_request(url, payload, timeout, scheduled):
+    """POST one image and return (status, parsed JSON body, client ms, server ms).
+
+    Client latency runs from the scheduled send time, not from when a worker
+    thread got to the request, so time spent queued behind slow responses
+    counts against the server instead of being silently dropped.
+    """
+    request = urllib.request.Request(
+        url,
+        data=payload,
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status = response.status
+            body = response.read()
+            server_ms = server_time_ms(response.headers.get('Server-Timing'))
+    except urllib.error.HTTPError as http_error:
+        status = http_error.code
+        body = http_error.read()
+        server_ms = server_time_ms(http_error.headers.get('Server-Timing'))
+    except Exception as error:
+        return None, {'error': str(error)}, (time.perf_counter() - scheduled) * 1000, None
+    client_ms = (time.perf_counter() - scheduled) * 1000
+
+    try:
+        result = json.loads(body)
+    except ValueError:
+        result = {}
+    return status, result, client_ms, server_ms
+
+
+def replay(capture_dir, url, speed, workers, timeout):
+    records = load_capture(capture_dir)
+    if not records:
+        print('No captured requests to replay')
+        return []
+
+    blobs = {}
+    for record in records:
+        digest = record['image']
+        if digest not in blobs:
+            image_bytes = (capture_dir / 'blobs' / digest).read_bytes()
+            blobs[digest] = json.dumps({'image': base64.b64encode(image_bytes).decode()}).encode()
+
+    print(f'▶️  Replaying {len(records)} requests ({len(blobs)} distinct images) '
+          f'against {url} at {"max" if speed <= 0 else f"{speed:g}x"} speed')
+
+    outcomes = []
+    outcomes_lock = threading.Lock()
+
+    def run(record, scheduled):
+        status, result, client_ms, server_ms = send_request(
+            url, blobs[record['image']], timeout, scheduled
+        )
+        with outcomes_lock:
+            outcomes.append((record, status, result, client_ms, server_ms))
+
+    first_ts = records[0]['ts']
+    replay_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for record in records:
+            if speed > 0:
+                # Keep the original inter-arrival gaps, compressed by the speed factor
+                scheduled = replay_started + (record['ts'] - first_ts) / speed
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                scheduled = time.perf_counter()
+            executor.submit(run, record, scheduled)
+
+    return outcomes
+
+
+def report(outcomes):
+    """Print latency distributions and result differences; return the diff count"""
+    if not outcomes:
+        return 0
+
+    def summarize(label, latencies):
+        print(f'  {label:<9} p50 {percentile(latencies, 50):8.1f} ms   '
+              f'p90 {percentile(latencies, 90):8.1f} ms   '
+              f'p99 {percentile(latencies, 99):8.1f} ms   '
+              f'max {max(latencies):8.1f} ms')
+
+    # Captured latency is handler time on the server; only compare it with the
+    # replay's Server-Timing, never with the client's round trip
+    print('\n📊 Server time inside /classify')
+    summarize('captured', [record['latency_ms'] for record, *_ in outcomes])
+    server_times = [server_ms for *_, server_ms in outcomes if server_ms is not None]
+    if server_times:
+        summarize('replayed', server_times)
+    if len(server_times) < len(outcomes):
+        print(f'  {len(outcomes) - len(server_times)} replayed responses had no Server-Timing header')
+
+    print('\n📊 Client latency from scheduled send (replay only, includes queueing and network)')
+    summarize('replayed', [client_ms for _, _, _, client_ms, _ in outcomes])
+
+    errors = sum(1 for _, status, *_ in outcomes if status is None)
+    if errors:
+        print(f'\n⚠️  {errors} requests failed to complete')
+
+    differences = []
+    for record, status, result, *_ in outcomes:
+        replayed = dict(result, status=status)
+        changed = {
+            field: (record.get(field), replayed.get(field))
+            for field in COMPARED_FIELDS
+            if record.get(field) != replayed.get(field)
+        }
+        if changed:
+            differences.append((record, changed))
+
+    print(f'\n🔍 {len(differences)} of {len(outcomes)} results differ from the capture')
+    for record, changed in differences[:20]:
+        details = ', '.join(f'{field}: {old!r} -> {new!r}' for field, (old, new) in changed.items())
+        print(f'  {record["image"][:12]}  {details}')
+    if len(differences) > 20:
+        print(f'  ... and {len(differences) - 20} more')
+
+    return len(differences)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay captured PicDetect traffic')
+    parser.add_argument('capture_dir', type=Path, help='directory written via PICDETECT_CAPTURE_DIR')
+    parser.add_argument('--url', default=DEFAULT_URL, help=f'classify endpoint (default {DEFAULT_URL})')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='pacing multiplier; 1 = original pacing, 0 = as fast as possible')
+    parser.add_argument('--workers', type=int, default=256,
+                        help='maximum requests in flight; time waiting for a free slot counts as latency')
+    parser.add_argument('--timeout', type=float, default=120.0, help='per-request timeout in seconds')
+    args = parser.parse_args()
+
+    outcomes = replay(args.capture_dir, args.url, args.speed, args.workers, args.timeout)
+    differences = report(outcomes)
+    sys.exit(1 if differences else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import json
+import os
+import platform
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import api_proxy
+import autotune
+
+
+def write_profile(path, host):
+    path.write_text(json.dumps({'host': host, 'config': {'batch_size': 4}}))
+
+
+def test_profile_from_this_host_is_loaded(tmp_path, monkeypatch):
+    path = tmp_path / 'profile.json'
+    write_profile(path, {
+        'cpu_count': os.cpu_count(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+    })
+    monkeypatch.setattr(api_proxy, 'PROFILE_PATH', path)
+    assert api_proxy._load_profile() == {'batch_size': 4}
+
+
+def test_profile_from_other_hardware_is_ignored(tmp_path, monkeypatch):
+    path = tmp_path / 'profile.json'
+    write_profile(path, {'cpu_count': (os.cpu_count() or 1) + 64, 'machine': platform.machine()})
+    monkeypatch.setattr(api_proxy, 'PROFILE_PATH', path)
+    assert api_proxy._load_profile() == {}
+
+
+def run_autotune(monkeypatch, tmp_path, results):
+    """Run the sweep with measure() answering from results, keyed by config"""
+    def fake_measure(config, args, cache):
+        cache[tuple(sorted(config.items()))] = results(config)
+        return cache[tuple(sorted(config.items()))]
+
+    monkeypatch.setattr(autotune, 'measure', fake_measure)
+    args = SimpleNamespace(
+        target_p99_ms=1000.0, concurrency=4, batch_sizes=[1, 2],
+        decode_workers=[0, 1], output=tmp_path / 'profile.json'
+    )
+    autotune.autotune(args)
+    return json.loads(args.output.read_text())
+
+
+def ok(rps, p99=100.0):
+    return {'requests': 10, 'errors': 0, 'throughput_rps': rps, 'p50_ms': 50.0, 'p99_ms': p99}
+
+
+def test_failing_starting_configuration_is_not_chosen(monkeypatch, tmp_path):
+    def results(config):
+        if config['batch_size'] == 2:
+            return ok(1.0)
+        # Every other configuration, including the starting one, had errors
+        return dict(ok(100.0), errors=3)
+
+    profile = run_autotune(monkeypatch, tmp_path, results)
+    assert profile['config']['batch_size'] == 2
+
+
+def test_no_clean_trial_fails_instead_of_writing_a_profile(monkeypatch, tmp_path):
+    with pytest.raises(SystemExit):
+        run_autotune(monkeypatch, tmp_path, lambda config: dict(ok(5.0), errors=1))
+    assert not (tmp_path / 'profile.json').exists()
+
+
+def test_torch_is_not_imported_without_thread_settings(monkeypatch):
+    # A None entry makes any `import torch` fail
+    monkeypatch.setitem(sys.modules, 'torch', None)
+    monkeypatch.setattr(api_proxy, '_torch_configured', False)
+    monkeypatch.setattr(api_proxy, 'TORCH_THREADS', 0)
+    monkeypatch.setattr(api_proxy, 'TORCH_INTEROP_THREADS', 0)
+    api_proxy.configure_torch()
+    assert api_proxy._torch_configured
+
+
+def test_failed_torch_configuration_is_retried(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'torch', None)
+    monkeypatch.setattr(api_proxy, '_torch_configured', False)
+    monkeypatch.setattr(api_proxy, 'TORCH_THREADS', 2)
+    with pytest.raises(ImportError):
+        api_proxy.configure_torch()
+    assert not api_proxy._torch_configured
@@ -0,0 +1,59 @@
+import io
+import os
+import signal
+
+import pytest
+from PIL import Image
+
+from decode_pool import DecodePool, DecodePoolError
+
+
+@pytest.fixture
+def pool():
+    pool = DecodePool(workers=1, slots=2)
+    yield pool
+    pool.close()
+
+
+def encode(img, fmt='PNG'):
+    buffer = io.BytesIO()
+    img.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def test_decode_downscales_and_returns_triage_statistics(pool):
+    image, stats = pool.decode(encode(Image.new('RGB', (900, 600), (10, 200, 10))), triage_size=64)
+    assert image.size == (336, 224)
+    assert (stats['width'], stats['height']) == (900, 600)
+    assert stats['max_range'] == 0
+
+
+def test_invalid_image_raises_the_decode_error(pool):
+    with pytest.raises(Exception) as excinfo:
+        pool.decode(b'not an image')
+    assert not isinstance(excinfo.value, DecodePoolError)
+
+
+def test_pool_recovers_after_a_worker_dies(pool):
+    image_bytes = encode(Image.new('RGB', (300, 300), 'white'))
+    pool.decode(image_bytes)
+
+    for pid in list(pool._executor._processes):
+        os.kill(pid, signal.SIGKILL)
+    with pytest.raises(DecodePoolError):
+        pool.decode(image_bytes)
+
+    image, _ = pool.decode(image_bytes)
+    assert image.size == (224, 224)
+    assert pool.stats()['restarts'] == 1
+
+
+def test_classify_returns_503_when_the_pool_fails(monkeypatch):
+    import api_proxy
+
+    def broken_decode(image_bytes):
+        raise DecodePoolError('Decode worker process died')
+
+    monkeypatch.setattr(api_proxy, 'decode_image', broken_decode)
+    response = api_proxy.app.test_client().post('/classify', json={'image': 'aGVsbG8='})
+    assert response.status_code == 503
@@ -0,0 +1,41 @@
+import base64
+import io
+import time
+
+from PIL import Image
+
+import api_proxy
+import replay
+
+
+def test_server_time_is_parsed_from_the_header():
+    assert replay.server_time_ms('app;dur=12.5') == 12.5
+    assert replay.server_time_ms('db;dur=3, app;desc="handler";dur=7') == 7.0
+    assert replay.server_time_ms(None) is None
+
+
+
+def test_percentile_uses_the_nearest_rank():
+    # The rank is rounded up: p99 of 150 samples is the 149th, not the 148th
+    assert replay.percentile(range(1, 151), 99) == 149
+    assert replay.percentile(range(1, 351), 99) == 347
+    assert replay.percentile(range(1, 101), 50) == 50
+    assert replay.percentile(range(1, 101), 7) == 7
+    assert replay.percentile([5], 99) == 5
+    assert replay.percentile([], 99) == 0.0
+
+def test_classify_reports_its_handler_time():
+    buffer = io.BytesIO()
+    Image.new('RGB', (100, 100), 'white').save(buffer, 'PNG')
+    response = api_proxy.app.test_client().post(
+        '/classify', json={'image': base64.b64encode(buffer.getvalue()).decode()}
+    )
+    assert replay.server_time_ms(response.headers.get('Server-Timing')) is not None
+
+
+def test_client_latency_counts_from_the_scheduled_send():
+    # A request that was due a second ago reports at least that second of latency
+    scheduled = time.perf_counter() - 1.0
+    status, _, client_ms, _ = replay.send_request('http://127.0.0.1:9/classify', b'{}', 1.0, scheduled)
+    assert status is None
+    assert client_ms >= 1000
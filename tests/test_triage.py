@@ -0,0 +1,116 @@
+import base64
+import io
+import random
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+import api_proxy
+from image_stats import color_statistics
+
+
+def encode(img, fmt='PNG'):
+    buffer = io.BytesIO()
+    img.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def triage(image_bytes):
+    """Return the triage (reason, result) for an upload, or None for full inference"""
+    _, stats = api_proxy.decode_image(image_bytes)
+    return api_proxy.triage_result(stats['width'], stats['height'], stats)
+
+
+def classify(image_bytes):
+    response = api_proxy.app.test_client().post(
+        '/classify', json={'image': base64.b64encode(image_bytes).decode()}
+    )
+    return response.status_code, response.get_json()
+
+
+def text_page():
+    page = Image.new('RGB', (1240, 1754), 'white')
+    draw = ImageDraw.Draw(page)
+    y = 100
+    for size in (18, 24, 32):
+        font = ImageFont.load_default(size)
+        for _ in range(5):
+            draw.text((100, y), 'The quick brown fox jumps over the lazy dog.', fill='black', font=font)
+            y += size * 2
+    return page
+
+
+def moon():
+    sky = Image.new('RGB', (1600, 1200), (5, 5, 15))
+    ImageDraw.Draw(sky).ellipse((900, 300, 960, 360), fill=(230, 230, 210))
+    return sky
+
+
+def bird_and_power_line():
+    sky = Image.new('RGB', (2000, 1500), (150, 160, 172))
+    draw = ImageDraw.Draw(sky)
+    draw.line((0, 900, 2000, 960), fill=(40, 40, 40), width=1)
+    draw.ellipse((1200, 400, 1212, 406), fill=(30, 30, 30))
+    return sky
+
+
+def small_object():
+    background = Image.new('RGB', (1000, 1000), 'white')
+    ImageDraw.Draw(background).rectangle((480, 480, 500, 500), fill=(200, 30, 30))
+    return background
+
+
+@pytest.mark.parametrize('make_image', [text_page, moon, bird_and_power_line, small_object])
+@pytest.mark.parametrize('fmt', ['PNG', 'JPEG'])
+def test_images_with_content_go_to_the_models(make_image, fmt):
+    assert triage(encode(make_image(), fmt)) is None
+
+
+
+def test_white_and_black_shares_match_the_per_pixel_definition():
+    rng = random.Random(0)
+    img = Image.frombytes('RGB', (40, 30), bytes(rng.choice((0, 49, 50, 149, 150, 200, 201, 255))
+                                                 for _ in range(40 * 30 * 3)))
+    pixels = list(zip(*(band.tobytes() for band in img.split())))
+    white = sum(1 for p in pixels if min(p) > 200) / len(pixels)
+    black = sum(1 for p in pixels if sum(p) / 3 < 50) / len(pixels)
+    stats = color_statistics(img)
+    assert stats['white_ratio'] == white
+    assert stats['black_ratio'] == black
+    assert 0 < white < 1 and 0 < black < 1
+
+def test_blank_image_is_triaged():
+    status, result = classify(encode(Image.new('RGB', (800, 600), 'white'), 'JPEG'))
+    assert status == 200
+    assert result['source'] == 'triage'
+    assert result['triage_reason'] == 'blank'
+    assert result['name'] == 'Blank White Image'
+
+
+def test_solid_color_image_is_triaged():
+    reason, result = triage(encode(Image.new('RGB', (300, 300), (200, 10, 10))))
+    assert reason == 'uniform'
+    assert result['name'] == 'Solid Red Image'
+
+
+def test_tiny_image_is_triaged():
+    reason, result = triage(encode(Image.new('RGB', (8, 8), 'white')))
+    assert reason == 'tiny'
+    assert '8x8' in result['description']
+
+
+def test_corrupt_image_is_rejected():
+    status, result = classify(b'\x89PNG not really')
+    assert status == 400
+    assert result['error'] == 'Invalid image data'
+
+
+def test_saved_model_time_excludes_corrupt_uploads(monkeypatch):
+    monkeypatch.setattr(api_proxy, '_triage_stats', {
+        'triaged': 3,
+        'by_reason': {'blank': 2, 'corrupt': 1},
+        'model_requests': 1,
+        'model_seconds': 2.0,
+    })
+    stats = api_proxy.app.test_client().get('/stats').get_json()
+    assert stats['triage']['model_seconds_saved'] == pytest.approx(4.0)